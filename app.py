@@ -4,7 +4,12 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
+import pyarrow as pa
+import contextlib
+import hashlib
+import mmap
 import os
+import tempfile
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -27,6 +32,8 @@ COLORS = {
 
 FUNNEL_COLORS = ["#3498DB", "#E8913A", "#2ECC71"]
 PALETTE = px.colors.qualitative.Set2
+# 時系列チャートに渡す最大点数（超える場合は期間を粗くして再集計）
+MAX_CHART_POINTS = 100
 
 st.markdown("""
 <style>
@@ -66,9 +73,48 @@ div[data-testid="stSidebar"] .stMarkdown label { color: #ECF0F1 !important; }
 # ──────────────────────────────────────────
 # データ読み込み・クレンジング
 # ──────────────────────────────────────────
+CACHE_DIR = ".cache"
+# クレンジング処理を変更したら上げる（古いParquetキャッシュを無効化）
+CACHE_VERSION = 7
+
+def source_digest(source):
+    """Excelファイル内容のハッシュ（Parquet・集計キャッシュのキー）"""
+    h = hashlib.blake2b(f"v{CACHE_VERSION}".encode(), digest_size=16)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            h.update(m)
+    else:
+        h.update(source.getvalue())
+    return h.hexdigest()
+
 @st.cache_data
-def load_data(source):
-    df = pd.read_excel(source)
+def cached_digest(_source, key):
+    """source_digestのキャッシュ版（keyが変わった時だけ内容をハッシュし直す）"""
+    return source_digest(_source)
+
+def data_digest(source):
+    """パスは(パス, 更新時刻, サイズ)、アップロードはfile_idをキーにハッシュを使い回す"""
+    if isinstance(source, (str, os.PathLike)):
+        stat = os.stat(source)
+        return cached_digest(source, (os.fspath(source), stat.st_mtime_ns, stat.st_size))
+    return cached_digest(source, source.file_id)
+
+@st.cache_data(persist="disk")
+def load_data(_source, digest):
+    # クレンジング済みのParquetがあればExcelの解析を丸ごとスキップ
+    cache_path = os.path.join(CACHE_DIR, f"{digest}.parquet")
+    if os.path.exists(cache_path):
+        try:
+            return pd.read_parquet(cache_path, engine="pyarrow")
+        except (OSError, ValueError, pa.ArrowException):
+            pass  # 壊れたキャッシュはExcelから作り直して上書きする
+
+    # クレンジングで参照する列だけを解析する
+    df = pd.read_excel(
+        _source, engine="calamine", dtype_backend="pyarrow",
+        usecols=["リードソース", "純 金融資産", "年代（資料請求時）", "投資経験年数",
+                 "リード進捗", "VTX_職業", "作成日", "売り上げ"],
+    )
 
     # リードソース統合
     source_map = {
@@ -82,7 +128,12 @@ def load_data(source):
         "columnSite": "コラムサイト",
         "LinkedIn": "LinkedIn",
     }
-    df["リードソース"] = df["リードソース"].map(source_map).fillna(df["リードソース"])
+    # カテゴリ単位で名寄せし、行ごとの文字列変換を避ける（NaNのコード-1はそのまま）
+    src = df["リードソース"].astype("category")
+    merged = src.cat.categories.map(lambda c: source_map.get(c, c))
+    new_cats = merged.unique().sort_values()
+    lookup = np.append(new_cats.get_indexer(merged), -1)
+    df["リードソース"] = pd.Categorical.from_codes(lookup[src.cat.codes], categories=new_cats)
 
     # 順序付きカテゴリ
     asset_order = ["2000万円未満", "5000万円未満", "1億円未満", "5億円未満", "5億円以上"]
@@ -90,17 +141,45 @@ def load_data(source):
     exp_order = ["なし", "1年未満", "3年未満", "3年以上"]
     progress_order = ["未面談", "面談後", "成約"]
 
-    df["純金融資産"] = pd.Categorical(df["純 金融資産"], categories=asset_order, ordered=True)
-    df["年代"] = pd.Categorical(df["年代（資料請求時）"], categories=age_order, ordered=True)
-    df["投資経験"] = pd.Categorical(df["投資経験年数"], categories=exp_order, ordered=True)
-    df["進捗"] = pd.Categorical(df["リード進捗"], categories=progress_order, ordered=True)
+    df["純金融資産"] = df["純 金融資産"].astype(pd.CategoricalDtype(asset_order, ordered=True))
+    df["年代"] = df["年代（資料請求時）"].astype(pd.CategoricalDtype(age_order, ordered=True))
+    df["投資経験"] = df["投資経験年数"].astype(pd.CategoricalDtype(exp_order, ordered=True))
+    df["進捗"] = df["リード進捗"].astype(pd.CategoricalDtype(progress_order, ordered=True))
     df["職業"] = df["VTX_職業"]
-    df["月"] = df["作成日"].dt.to_period("M").astype(str)
+    df["月"] = df["作成日"].dt.strftime("%Y-%m")
 
     # 成約フラグ / 面談フラグ
     df["is_meeting"] = df["進捗"].isin(["面談後", "成約"]).astype(int)
     df["is_closed"] = (df["進捗"] == "成約").astype(int)
 
+    # 低カーディナリティの文字列列はカテゴリ、数値列はArrow型に
+    for c in ("職業", "月"):
+        df[c] = df[c].astype("category")
+    df["売り上げ"] = df["売り上げ"].astype("float64[pyarrow]")
+    df["is_meeting"] = df["is_meeting"].astype("int8[pyarrow]")
+    df["is_closed"] = df["is_closed"].astype("int8[pyarrow]")
+
+    # 成約行の売上（成約以外は欠損。売上未入力の成約行は平均の分母から外れる）
+    df["closed_rev"] = df["売り上げ"].where(df["is_closed"] == 1)
+
+    # 以降で参照する列だけに絞り、copyで断片化したブロックをまとめる
+    df = df[["リードソース", "純金融資産", "年代", "投資経験", "職業", "月", "作成日",
+             "is_meeting", "is_closed", "売り上げ", "closed_rev"]].copy()
+
+    # 一時ファイルに書いてから置き換え、途中で落ちても壊れたキャッシュを残さない。
+    # 書き込みに失敗しても読み込み自体は継続する
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".parquet.tmp")
+        os.close(fd)
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd")
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError, TypeError, pa.ArrowException):
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
     return df
 
 # ファイル読み込み: リポジトリ内 → アップロード → ファイルアップローダー
@@ -126,7 +205,9 @@ if data_source is None:
         st.stop()
     data_source = uploaded
 
-df = load_data(data_source)
+# ファイル内容のハッシュを集計キャッシュのキーとして使い回す
+df_id = data_digest(data_source)
+df = load_data(data_source, df_id)
 
 # ──────────────────────────────────────────
 # ユーティリティ関数
@@ -137,7 +218,8 @@ def calc_funnel(data):
     meeting = data["is_meeting"].sum()
     closed = data["is_closed"].sum()
     revenue = data["売り上げ"].sum()
-    avg_revenue = data.loc[data["is_closed"] == 1, "売り上げ"].mean() if closed > 0 else 0
+    avg_revenue = data["closed_rev"].mean()
+    avg_revenue = 0 if pd.isna(avg_revenue) else avg_revenue
     meeting_rate = meeting / n * 100 if n > 0 else 0
     close_rate = closed / n * 100 if n > 0 else 0
     close_from_meeting = closed / meeting * 100 if meeting > 0 else 0
@@ -150,15 +232,92 @@ def calc_funnel(data):
 
 def funnel_table(data, group_col):
     """グループ別ファネルテーブルを作成"""
-    rows = []
-    for name, grp in data.groupby(group_col, observed=True):
-        f = calc_funnel(grp)
-        f[group_col] = name
-        rows.append(f)
-    result = pd.DataFrame(rows)
-    if len(result) > 0:
-        result = result.set_index(group_col)
-    return result
+    ft = data.groupby(group_col, observed=True).agg(
+        リード数=("is_closed", "size"),
+        面談数=("is_meeting", "sum"),
+        成約数=("is_closed", "sum"),
+        売上合計=("売り上げ", "sum"),
+        平均売上=("closed_rev", "mean"),
+    )
+    ft["面談率"] = ft["面談数"] / ft["リード数"] * 100
+    ft["成約率"] = ft["成約数"] / ft["リード数"] * 100
+    ft["面談→成約率"] = (ft["成約数"] / ft["面談数"].where(ft["面談数"] > 0) * 100).fillna(0)
+    ft["平均売上"] = ft["平均売上"].fillna(0)
+    return ft[["リード数", "面談数", "成約数", "面談率", "成約率", "面談→成約率", "売上合計", "平均売上"]]
+
+@st.cache_data
+def cached_funnel_table(_data, df_id, group_col):
+    """funnel_tableのキャッシュ版（データ全体を集計する場合用）"""
+    return funnel_table(_data, group_col)
+
+@st.cache_data
+def cached_overall(_data, df_id):
+    """データ全体のファネル指標（ページ①と⑤で共有）"""
+    return calc_funnel(_data)
+
+@st.cache_data
+def monthly_summary(_data, df_id):
+    """月次のリード数・面談数・成約数・売上（月のカテゴリコードをbincountで集計）"""
+    month = _data["月"]
+    codes = month.cat.codes.to_numpy()
+    valid = codes >= 0
+    codes = codes[valid]
+    size = len(month.cat.categories)
+
+    def month_sum(col):
+        weights = _data[col].to_numpy(dtype=float, na_value=0)[valid]
+        return np.bincount(codes, weights=weights, minlength=size)
+
+    monthly = pd.DataFrame({
+        "月": month.cat.categories,
+        "リード数": np.bincount(codes, minlength=size),
+        "面談数": month_sum("is_meeting").astype(int),
+        "成約数": month_sum("is_closed").astype(int),
+        "売上": month_sum("売り上げ"),
+    })
+    monthly = monthly[monthly["リード数"] > 0].reset_index(drop=True)
+    monthly["面談率"] = monthly["面談数"] / monthly["リード数"] * 100
+    monthly["成約率"] = monthly["成約数"] / monthly["リード数"] * 100
+    return monthly
+
+@st.cache_data
+def category_options(_data, df_id, cols):
+    """カテゴリ列ごとの選択肢（出現する値のみ、文字列でソート済み）"""
+    return {
+        c: sorted(str(v) for v in _data[c].cat.remove_unused_categories().cat.categories)
+        for c in cols
+    }
+
+def coarsen_monthly(monthly, max_points=MAX_CHART_POINTS):
+    """期間数が多すぎる場合は四半期→年の順に再集計して描画点数を抑える"""
+    if len(monthly) <= max_points:
+        return monthly
+    months = pd.PeriodIndex(monthly["月"].astype(str), freq="M")
+    for freq in ("Q", "Y"):
+        period = months.asfreq(freq).astype(str)
+        if period.nunique() <= max_points:
+            break
+    coarse = monthly.groupby(period.rename("月"))[["リード数", "面談数", "成約数", "売上"]].sum().reset_index()
+    coarse["面談率"] = coarse["面談数"] / coarse["リード数"] * 100
+    coarse["成約率"] = coarse["成約数"] / coarse["リード数"] * 100
+    return coarse
+
+@st.cache_data
+def attribute_rates(_data, df_id, dim_cols):
+    """属性カテゴリ×属性値ごとの成約率・平均売上（縦持ちにして1回で集計）"""
+    long = _data[["is_closed", "closed_rev", *dim_cols]].melt(
+        id_vars=["is_closed", "closed_rev"], var_name="属性カテゴリ", value_name="属性値")
+    long["属性カテゴリ"] = pd.Categorical(long["属性カテゴリ"], categories=dim_cols)
+    rates = long.groupby(["属性カテゴリ", "属性値"], observed=True).agg(
+        リード数=("is_closed", "size"),
+        成約数=("is_closed", "sum"),
+        平均売上=("closed_rev", "mean"),
+    ).reset_index()
+    rates["属性カテゴリ"] = rates["属性カテゴリ"].astype(str)
+    rates["属性値"] = rates["属性値"].astype(str)
+    rates["成約率"] = rates["成約数"] / rates["リード数"] * 100
+    rates["平均売上"] = rates["平均売上"].fillna(0)
+    return rates[["属性カテゴリ", "属性値", "リード数", "成約数", "成約率", "平均売上"]]
 
 def format_yen(val):
     if val >= 1e8:
@@ -168,12 +327,29 @@ def format_yen(val):
     else:
         return f"¥{val:,.0f}"
 
+def format_yen_array(values):
+    """format_yenの配列版（分岐をマスクでまとめて処理）"""
+    a = np.asarray(values, dtype=float)
+    oku = a >= 1e8
+    man = (a >= 1e4) & ~oku
+    rest = ~(oku | man)
+    out = np.empty(a.shape, dtype=object)
+    out[oku] = [f"¥{v / 1e8:.1f}億" for v in a[oku]]
+    out[man] = [f"¥{v / 1e4:.0f}万" for v in a[man]]
+    out[rest] = [f"¥{v:,.0f}" for v in a[rest]]
+    return out
+
+def sample_warning_array(n):
+    """サンプル数バッジHTMLの配列版（n≤10: 要注意 / n≤30: △ / それ以外: 良好）"""
+    n = np.asarray(n, dtype=int)
+    n_str = n.astype(str)
+    warn = np.char.add(np.char.add('<span class="warning-badge">⚠ n=', n_str), ' 要注意</span>')
+    mid = np.char.add(np.char.add('<span class="warning-badge">△ n=', n_str), '</span>')
+    good = np.char.add(np.char.add('<span class="good-badge">n=', n_str), '</span>')
+    return np.select([n <= 10, n <= 30], [warn, mid], default=good)
+
 def sample_warning(n):
-    if n <= 10:
-        return f'<span class="warning-badge">⚠ n={n} 要注意</span>'
-    elif n <= 30:
-        return f'<span class="warning-badge">△ n={n}</span>'
-    return f'<span class="good-badge">n={n}</span>'
+    return str(sample_warning_array(n))
 
 def metric_card(label, value, sub=""):
     sub_html = f'<p style="margin:2px 0 0;font-size:12px;color:#95A5A6;">{sub}</p>' if sub else ""
@@ -213,7 +389,7 @@ if page == "① エグゼクティブサマリー":
     st.markdown("# 📈 エグゼクティブサマリー")
     st.markdown("事業全体のファネルパフォーマンスと月次推移を一覧します。")
 
-    overall = calc_funnel(df)
+    overall = cached_overall(df, df_id)
 
     # KPIカード
     cols = st.columns(5)
@@ -259,14 +435,10 @@ if page == "① エグゼクティブサマリー":
 
     # 月次推移
     st.markdown('<div class="section-title">月次推移</div>', unsafe_allow_html=True)
-    monthly = df.groupby("月", observed=True).agg(
-        リード数=("is_closed", "count"),
-        面談数=("is_meeting", "sum"),
-        成約数=("is_closed", "sum"),
-        売上=("売り上げ", "sum"),
-    ).reset_index()
-    monthly["面談率"] = monthly["面談数"] / monthly["リード数"] * 100
-    monthly["成約率"] = monthly["成約数"] / monthly["リード数"] * 100
+    monthly_full = monthly_summary(df, df_id)
+    monthly = coarsen_monthly(monthly_full)
+    if len(monthly) < len(monthly_full):
+        st.caption(f"期間が長いため{len(monthly)}区間に再集計して表示しています。")
 
     fig_monthly = make_subplots(specs=[[{"secondary_y": True}]])
     fig_monthly.add_trace(
@@ -295,7 +467,7 @@ if page == "① エグゼクティブサマリー":
     fig_rev.add_trace(go.Bar(
         x=monthly["月"], y=monthly["売上"], name="売上",
         marker_color="#E8913A", opacity=0.85,
-        text=[format_yen(v) for v in monthly["売上"]],
+        text=format_yen_array(monthly["売上"]),
         textposition="outside"
     ))
     fig_rev.update_layout(
@@ -323,7 +495,7 @@ elif page == "② 単軸ファネル分析":
     selected_axis = st.selectbox("分析軸を選択", list(axis_options.keys()))
     col_name = axis_options[selected_axis]
 
-    ft = funnel_table(df, col_name)
+    ft = cached_funnel_table(df, df_id, col_name)
     if len(ft) == 0:
         st.warning("データがありません。")
     else:
@@ -334,8 +506,8 @@ elif page == "② 単軸ファネル分析":
         display_df["面談率"] = display_df["面談率"].apply(lambda x: f"{x:.1f}%")
         display_df["成約率"] = display_df["成約率"].apply(lambda x: f"{x:.1f}%")
         display_df["面談→成約率"] = display_df["面談→成約率"].apply(lambda x: f"{x:.1f}%")
-        display_df["売上合計"] = display_df["売上合計"].apply(format_yen)
-        display_df["平均売上"] = display_df["平均売上"].apply(lambda x: format_yen(x) if x > 0 else "—")
+        display_df["売上合計"] = format_yen_array(display_df["売上合計"])
+        display_df["平均売上"] = np.where(display_df["平均売上"] > 0, format_yen_array(display_df["平均売上"]), "—")
         display_df["リード数"] = display_df["リード数"].astype(int)
         display_df["面談数"] = display_df["面談数"].astype(int)
         display_df["成約数"] = display_df["成約数"].astype(int)
@@ -396,7 +568,7 @@ elif page == "② 単軸ファネル分析":
             fig_rev = go.Figure(go.Bar(
                 y=rev_data.index.astype(str), x=rev_data["売上合計"],
                 orientation="h", marker_color="#E8913A",
-                text=[format_yen(v) for v in rev_data["売上合計"]],
+                text=format_yen_array(rev_data["売上合計"]),
                 textposition="outside",
             ))
             fig_rev.update_layout(
@@ -435,21 +607,18 @@ elif page == "③ 二軸クロス分析":
     x_col = dim_options[axis_x]
     y_col = dim_options[axis_y]
 
-    # クロス集計
-    cross_data = []
-    for (xv, yv), grp in df.groupby([x_col, y_col], observed=True):
-        f = calc_funnel(grp)
-        f[x_col] = xv
-        f[y_col] = yv
-        cross_data.append(f)
+    # クロス集計（1回のgroupbyから指標とn数を展開）
+    cross_df = cached_funnel_table(df, df_id, [x_col, y_col])
 
-    if len(cross_data) == 0:
+    if len(cross_df) == 0:
         st.warning("データがありません。")
     else:
-        cross_df = pd.DataFrame(cross_data)
-
-        pivot = cross_df.pivot_table(index=x_col, columns=y_col, values=metric, aggfunc="first")
-        pivot_n = cross_df.pivot_table(index=x_col, columns=y_col, values="リード数", aggfunc="first").fillna(0)
+        pivot = cross_df[metric].unstack(y_col).astype(float)
+        pivot_n = cross_df["リード数"].unstack(y_col).astype(float).fillna(0)
+        # unstack後の軸はカテゴリ型のままなので、表示用に文字列ラベルへ揃える
+        for frame in (pivot, pivot_n):
+            frame.index = frame.index.astype(str)
+            frame.columns = frame.columns.astype(str)
 
         # カスタムテキスト（値 + n数）
         if metric in ["成約率", "面談率", "面談→成約率"]:
@@ -457,7 +626,8 @@ elif page == "③ 二軸クロス分析":
             fmt = ".1f"
             colorscale = "YlOrRd"
         elif metric == "売上合計":
-            text_matrix = pivot.map(lambda x: format_yen(x) if pd.notna(x) and x > 0 else "—")
+            text_matrix = pd.DataFrame(np.where(pivot > 0, format_yen_array(pivot), "—"),
+                                       index=pivot.index, columns=pivot.columns)
             fmt = ","
             colorscale = "YlGnBu"
         else:
@@ -465,20 +635,13 @@ elif page == "③ 二軸クロス分析":
             fmt = ","
             colorscale = "Blues"
 
-        # n数をテキストに追加
-        combined_text = []
-        for i in range(len(text_matrix)):
-            row = []
-            for j in range(len(text_matrix.columns)):
-                val = text_matrix.iloc[i, j]
-                n_val = int(pivot_n.iloc[i, j]) if pd.notna(pivot_n.iloc[i, j]) else 0
-                if n_val <= 10 and n_val > 0:
-                    row.append(f"{val}<br><b style='color:red'>n={n_val}</b>")
-                elif n_val > 0:
-                    row.append(f"{val}<br>n={n_val}")
-                else:
-                    row.append("—")
-            combined_text.append(row)
+        # n数をテキストに追加（n≤10は赤字、n=0は「—」）
+        t = text_matrix.to_numpy().astype(str)
+        nv = pivot_n.to_numpy().astype(int)
+        nv_str = nv.astype(str)
+        small_text = np.char.add(np.char.add(t, "<br><b style='color:red'>n="), np.char.add(nv_str, "</b>"))
+        med_text = np.char.add(np.char.add(t, "<br>n="), nv_str)
+        combined_text = np.select([nv <= 0, nv <= 10], ["—", small_text], default=med_text).tolist()
 
         fig_heat = go.Figure(data=go.Heatmap(
             z=pivot.values,
@@ -508,7 +671,8 @@ elif page == "③ 二軸クロス分析":
         if metric in ["成約率", "面談率"]:
             styled_pivot = styled_pivot.map(lambda x: f"{x:.1f}%" if pd.notna(x) else "—")
         elif metric == "売上合計":
-            styled_pivot = styled_pivot.map(lambda x: format_yen(x) if pd.notna(x) and x > 0 else "—")
+            styled_pivot = pd.DataFrame(np.where(pivot > 0, format_yen_array(pivot), "—"),
+                                        index=pivot.index, columns=pivot.columns)
         else:
             styled_pivot = styled_pivot.map(lambda x: f"{int(x)}" if pd.notna(x) else "0")
         st.dataframe(styled_pivot, use_container_width=True)
@@ -541,21 +705,21 @@ elif page == "④ 多軸ドリルダウン":
 
     # 第1軸フィルタ
     st.markdown(f'<div class="section-title">第1軸: {axis1}</div>', unsafe_allow_html=True)
-    ft1 = funnel_table(df, dim_map[axis1])
+    ft1 = cached_funnel_table(df, df_id, dim_map[axis1])
 
     display1 = ft1[["リード数", "成約数", "成約率", "売上合計"]].copy()
     display1["成約率"] = display1["成約率"].apply(lambda x: f"{x:.1f}%")
-    display1["売上合計"] = display1["売上合計"].apply(format_yen)
+    display1["売上合計"] = format_yen_array(display1["売上合計"])
     display1["リード数"] = display1["リード数"].astype(int)
     display1["成約数"] = display1["成約数"].astype(int)
     st.dataframe(display1, use_container_width=True)
 
-    options1 = df[dim_map[axis1]].dropna().unique().tolist()
-    options1_str = sorted([str(o) for o in options1])
+    options1_str = category_options(df, df_id, tuple(dim_map.values()))[dim_map[axis1]]
     selected1 = st.multiselect(f"{axis1}を選択（複数可）", options1_str, default=options1_str[:3] if len(options1_str) > 3 else options1_str)
 
     if selected1:
-        filtered1 = df[df[dim_map[axis1]].astype(str).isin(selected1)]
+        # カテゴリ列のisinはカテゴリコード上で判定される（文字列列を作らない）
+        filtered1 = df[df[dim_map[axis1]].isin(selected1)]
         n_filtered = len(filtered1)
         st.info(f"フィルタ後: {n_filtered}件")
 
@@ -599,12 +763,12 @@ elif page == "④ 多軸ドリルダウン":
             if axis3 != "なし":
                 st.markdown(f'<div class="section-title">第3軸: {axis3}</div>', unsafe_allow_html=True)
 
-                options2 = filtered1[dim_map[axis2]].dropna().unique().tolist()
-                options2_str = sorted([str(o) for o in options2])
+                # ft2はfiltered1上でobserved=Trueの集計なので、そのindexが出現値の一覧になる
+                options2_str = sorted(ft2.index.astype(str))
                 selected2 = st.multiselect(f"{axis2}を選択", options2_str, default=options2_str[:3] if len(options2_str) > 3 else options2_str)
 
                 if selected2:
-                    filtered2 = filtered1[filtered1[dim_map[axis2]].astype(str).isin(selected2)]
+                    filtered2 = filtered1[filtered1[dim_map[axis2]].isin(selected2)]
                     st.info(f"フィルタ後: {len(filtered2)}件")
 
                     ft3 = funnel_table(filtered2, dim_map[axis3])
@@ -612,7 +776,7 @@ elif page == "④ 多軸ドリルダウン":
                         display3 = ft3[["リード数", "面談数", "成約数", "面談率", "成約率", "売上合計"]].copy()
                         display3["面談率"] = display3["面談率"].apply(lambda x: f"{x:.1f}%")
                         display3["成約率"] = display3["成約率"].apply(lambda x: f"{x:.1f}%")
-                        display3["売上合計"] = display3["売上合計"].apply(format_yen)
+                        display3["売上合計"] = format_yen_array(display3["売上合計"])
                         st.dataframe(display3, use_container_width=True)
 
                         small3 = ft3[ft3["リード数"] <= 10]
@@ -641,33 +805,23 @@ elif page == "⑤ リードスコアリング":
     }
 
     # 全属性の成約率を横並びで表示
-    all_rates = []
-    for label, col in dims.items():
-        for val, grp in df.groupby(col, observed=True):
-            n = len(grp)
-            closed = grp["is_closed"].sum()
-            rate = closed / n * 100 if n > 0 else 0
-            rev = grp.loc[grp["is_closed"] == 1, "売り上げ"].mean() if closed > 0 else 0
-            all_rates.append({
-                "属性カテゴリ": label,
-                "属性値": str(val),
-                "リード数": n,
-                "成約数": closed,
-                "成約率": rate,
-                "平均売上": rev,
-            })
-    rates_df = pd.DataFrame(all_rates)
+    rates_df = attribute_rates(df, df_id, tuple(dims.values()))
 
     # バブルチャート: 成約率 × リード数 × 平均売上
-    fig_bubble = px.scatter(
-        rates_df[rates_df["成約数"] > 0],
-        x="リード数", y="成約率",
-        size="平均売上", color="属性カテゴリ",
-        hover_name="属性値",
-        hover_data={"リード数": True, "成約率": ":.1f", "平均売上": ":,.0f", "成約数": True},
-        color_discrete_sequence=PALETTE,
-        size_max=50,
-    )
+    # SVGではなくWebGL（Scattergl）で描画し、再描画時のレイアウト計算を避ける
+    bubble_df = rates_df[rates_df["成約数"] > 0]
+    sizeref = bubble_df["平均売上"].max() / 50 ** 2  # px.scatter(size_max=50)と同じ面積スケール
+    fig_bubble = go.Figure()
+    for i, (category, grp) in enumerate(bubble_df.groupby("属性カテゴリ", sort=False)):
+        fig_bubble.add_trace(go.Scattergl(
+            x=grp["リード数"], y=grp["成約率"], mode="markers", name=category,
+            hovertext=grp["属性値"],
+            customdata=grp[["成約数", "平均売上"]].to_numpy(dtype=float),
+            hovertemplate=("<b>%{hovertext}</b><br>リード数=%{x}<br>成約率=%{y:.1f}<br>"
+                           "平均売上=%{customdata[1]:,.0f}<br>成約数=%{customdata[0]}<extra></extra>"),
+            marker=dict(size=grp["平均売上"], sizemode="area", sizeref=sizeref,
+                        color=PALETTE[i % len(PALETTE)]),
+        ))
     fig_bubble.update_layout(
         height=500,
         margin=dict(l=40, r=40, t=20, b=40),
@@ -684,7 +838,7 @@ elif page == "⑤ リードスコアリング":
     rank_df = rates_df.sort_values("成約率", ascending=False).head(20)
     rank_display = rank_df[["属性カテゴリ", "属性値", "リード数", "成約数", "成約率", "平均売上"]].copy()
     rank_display["成約率"] = rank_display["成約率"].apply(lambda x: f"{x:.1f}%")
-    rank_display["平均売上"] = rank_display["平均売上"].apply(lambda x: format_yen(x) if x > 0 else "—")
+    rank_display["平均売上"] = np.where(rank_display["平均売上"] > 0, format_yen_array(rank_display["平均売上"]), "—")
     rank_display = rank_display.reset_index(drop=True)
     rank_display.index += 1
     st.dataframe(rank_display, use_container_width=True)
@@ -695,7 +849,7 @@ elif page == "⑤ リードスコアリング":
 
     col1, col2 = st.columns(2)
     with col1:
-        sim_source = st.multiselect("リードソース", df["リードソース"].dropna().unique().tolist(),
+        sim_source = st.multiselect("リードソース", category_options(df, df_id, tuple(dims.values()))["リードソース"],
                                      default=["Yahoo", "Google"])
         sim_asset = st.multiselect("純金融資産", ["2000万円未満", "5000万円未満", "1億円未満", "5億円未満", "5億円以上"],
                                     default=["5億円未満", "5億円以上"])
@@ -705,16 +859,17 @@ elif page == "⑤ リードスコアリング":
         sim_exp = st.multiselect("投資経験", ["なし", "1年未満", "3年未満", "3年以上"],
                                   default=["3年以上"])
 
-    # フィルタ適用
-    sim_df = df.copy()
+    # フィルタ適用（条件を1つのマスクにまとめて一度だけ抽出）
+    mask = np.ones(len(df), dtype=bool)
     if sim_source:
-        sim_df = sim_df[sim_df["リードソース"].isin(sim_source)]
+        mask &= df["リードソース"].isin(sim_source).to_numpy()
     if sim_asset:
-        sim_df = sim_df[sim_df["純金融資産"].isin(sim_asset)]
+        mask &= df["純金融資産"].isin(sim_asset).to_numpy()
     if sim_age:
-        sim_df = sim_df[sim_df["年代"].isin(sim_age)]
+        mask &= df["年代"].isin(sim_age).to_numpy()
     if sim_exp:
-        sim_df = sim_df[sim_df["投資経験"].isin(sim_exp)]
+        mask &= df["投資経験"].isin(sim_exp).to_numpy()
+    sim_df = df[mask]
 
     sim_result = calc_funnel(sim_df)
 
@@ -731,7 +886,7 @@ elif page == "⑤ リードスコアリング":
         col.markdown(metric_card(label, value, sub), unsafe_allow_html=True)
 
     # 全体との比較
-    overall = calc_funnel(df)
+    overall = cached_overall(df, df_id)
     if sim_result["リード数"] > 0:
         st.markdown("")
         comp_data = {